@@ -1,8 +1,15 @@
 import os
+import time
+import threading
 import uuid
 import logging
-from flask import Flask, request, render_template, send_file, url_for, redirect, flash
-from werkzeug.utils import secure_filename
+import tempfile
+import mimetypes
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import (Flask, Request, request, render_template, send_file, url_for, redirect, flash, jsonify,
+                   abort, make_response)
+from werkzeug.utils import secure_filename, cached_property
 from video_processing import process_videos
 
 # Configure logging for debugging and error reporting.
@@ -19,9 +26,103 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Reject request bodies larger than 4 GB.
+app.config['MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024 * 1024
+
+# Let the front-end web server stream files instead of Python when deployed behind one:
+# USE_X_SENDFILE=1 for Apache (mod_xsendfile) or lighttpd, or X_ACCEL_REDIRECT set to the
+# internal nginx location that aliases the upload folder (for example '/protected-uploads/').
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+X_ACCEL_REDIRECT = os.environ.get('X_ACCEL_REDIRECT')
+
 # Allowed file extensions for video uploads.
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
 
+# Worker processes that run the video processing pipeline off the request thread.
+MAX_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+EXECUTOR = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+
+# Guards replacing EXECUTOR when a dead worker has broken it.
+EXECUTOR_LOCK = threading.Lock()
+
+# Submitted processing jobs, keyed by their unique identifier.
+JOBS = {}
+
+# Seconds a finished job stays reachable through /status and /result.
+JOB_RETENTION = 60 * 60
+
+def submit_job(uid, fn, *args):
+    """
+    Queue a call in the worker pool under the given job id.
+    Finished jobs older than JOB_RETENTION are forgotten first, and a pool left
+    broken by a worker that died is replaced before the call is resubmitted.
+    """
+    global EXECUTOR
+    now = time.monotonic()
+    for old_uid, future in list(JOBS.items()):
+        if future.done() and now - getattr(future, 'finished_at', now) > JOB_RETENTION:
+            JOBS.pop(old_uid, None)
+    with EXECUTOR_LOCK:
+        try:
+            future = EXECUTOR.submit(fn, *args)
+        except BrokenProcessPool:
+            logging.warning("Worker pool is broken; starting a new one.")
+            EXECUTOR.shutdown(wait=False)
+            EXECUTOR = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+            future = EXECUTOR.submit(fn, *args)
+    future.add_done_callback(lambda f: setattr(f, 'finished_at', time.monotonic()))
+    JOBS[uid] = future
+
+class UploadRequest(Request):
+    """
+    Request that streams uploaded files straight into the upload folder.
+    Werkzeug normally spools large uploads to a temporary file that FileStorage.save
+    then copies again; writing them next to their final location means they can be
+    moved into place with a rename instead.
+    """
+    @cached_property
+    def upload_parts(self):
+        """
+        Part files created for this request's uploads.
+        """
+        return []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        part = tempfile.NamedTemporaryFile('wb+', dir=app.config['UPLOAD_FOLDER'],
+                                           prefix='upload_', suffix='.part', delete=False)
+        self.upload_parts.append(part)
+        return part
+
+app.request_class = UploadRequest
+
+def save_upload(file, path):
+    """
+    Move an uploaded file from its streamed part file to its final path.
+    """
+    file.stream.close()
+    os.replace(file.stream.name, path)
+
+def discard_uploads(req):
+    """
+    Delete the part files of any uploads in a request that were not saved.
+    """
+    for part in req.upload_parts:
+        part.close()
+        if os.path.exists(part.name):
+            os.remove(part.name)
+
+def send_video(path):
+    """
+    Serve a file from the upload folder with conditional and range request support,
+    so browsers can seek through a preview without downloading it again.
+    """
+    if X_ACCEL_REDIRECT:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT.rstrip('/') + '/' + os.path.basename(path)
+        response.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return response
+    return send_file(path, conditional=True, etag=True)
+
 def allowed_file(filename):
     """
     Check if the uploaded file has an allowed extension.
@@ -41,14 +142,16 @@ def process():
     Handle the video processing request:
       - Validate and save uploaded video files.
       - Parse both basic and advanced processing parameters from the form.
-      - Invoke the video processing pipeline.
-      - Render the page with a preview and download option for the output video.
+      - Submit the video processing pipeline to the worker pool.
+      - Render the page with the job ID so it can poll for the result.
     """
     try:
         # Basic options
         remove_spspps = request.form.get('remove_spspps', 'yes')
         # I-frame removal mode: 'none', 'first', or 'all'
         removal_mode = request.form.get('remove_iframes', 'first')
+        # Re-encoding with libx264 is opt-in; by default the stream is copied as is.
+        reencode = request.form.get('reencode', 'no') == 'yes'
         try:
             offset = float(request.form.get('offset', '0.0'))
         except ValueError:
@@ -109,22 +212,23 @@ def process():
         video1_path = os.path.join(app.config['UPLOAD_FOLDER'], video1_filename)
         video2_path = os.path.join(app.config['UPLOAD_FOLDER'], video2_filename)
         
-        # Save the uploaded files to disk.
-        video1_file.save(video1_path)
-        video2_file.save(video2_path)
+        # Move the uploaded files, already streamed to disk, into place.
+        save_upload(video1_file, video1_path)
+        save_upload(video2_file, video2_path)
         logging.info("Uploaded files saved successfully.")
 
-        # Process the videos using the advanced pipeline.
-        output_video_path = process_videos(
+        # Queue the videos for the advanced pipeline in a worker process.
+        submit_job(
+            uid, process_videos,
             video1_path, video2_path, uid, remove_spspps, removal_mode,
             offset, app.config['UPLOAD_FOLDER'],
             duplicate_pframes, duplicate_probability, reorder_intensity, reorder_window_size,
-            corrupt_pframes_chance, corruption_intensity, drop_frame_percentage
+            corrupt_pframes_chance, corruption_intensity, drop_frame_percentage,
+            reencode
         )
+        logging.info("Queued processing job %s.", uid)
 
-        # Generate the URL for previewing and downloading the output video.
-        video_url = url_for('uploaded_file', filename=os.path.basename(output_video_path))
-        return render_template('index.html', video_url=video_url)
+        return render_template('index.html', job_id=uid), 202
 
     except Exception as e:
         # Log the error and notify the user with a flash message.
@@ -132,12 +236,42 @@ def process():
         flash("An error occurred during video processing. Please try again.")
         return redirect(url_for('index'))
 
+    finally:
+        # Clean up uploads rejected by validation or left behind by an error.
+        discard_uploads(request)
+
+@app.route('/status/<uid>')
+def job_status(uid):
+    """
+    Report whether a processing job is still running, has finished, or has failed.
+    """
+    future = JOBS.get(uid)
+    if future is None:
+        abort(404)
+    if not future.done():
+        return jsonify(status='processing')
+    if future.exception() is not None:
+        logging.error("Processing job %s failed: %s", uid, future.exception())
+        return jsonify(status='failed',
+                       message="An error occurred during video processing. Please try again.")
+    return jsonify(status='done', video_url=url_for('job_result', uid=uid))
+
+@app.route('/result/<uid>')
+def job_result(uid):
+    """
+    Serve the output video of a finished processing job.
+    """
+    future = JOBS.get(uid)
+    if future is None or not future.done() or future.exception() is not None:
+        abort(404)
+    return send_video(future.result())
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """
     Serve the processed video file so users can preview or download it.
     """
-    return send_file(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    return send_video(os.path.join(app.config['UPLOAD_FOLDER'], filename))
 
 if __name__ == '__main__':
     # Run the Flask application in debug mode.
@@ -1,47 +1,286 @@
 import os
+import mmap
+import shutil
 import subprocess
 import logging
-import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
-def extract_raw_stream(input_path, output_path):
+# Maximum number of buffers handed to a single os.writev call.
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+# Processed streams up to this size are assembled into one buffer and written with a
+# single call; larger ones are written with scatter-gather I/O to bound memory use.
+_SINGLE_WRITE_LIMIT = 256 * 1024 * 1024
+
+# Streams with more NAL units than this are classified in chunks on parallel threads.
+_CLASSIFY_CHUNK_SIZE = 1 << 16
+
+# Layout of one output plan row: a NAL unit's byte range in the input, how many
+# times it is written in a row, and whether those copies are corrupted.
+PLAN_DTYPE = np.dtype([('start', np.int64), ('end', np.int64), ('count', np.int32), ('corrupt', np.bool_)])
+
+def extract_raw_stream(input_path, output_path, offset=0):
     """
     Extract a raw H.264 bitstream (Annex B format) from an input video file using ffmpeg.
+    An offset is applied as an input seek, where the source container still has
+    timestamps to seek by, so skipping the start of a clip needs no extra ffmpeg pass.
+    Because the stream is copied rather than decoded, the seek snaps back to the
+    keyframe at or before the offset, and the extracted stream starts with that IDR
+    frame (the one removal_mode='first' strips).
     
     Parameters:
       input_path (str): Path to the source video file.
       output_path (str): Destination file path for the raw stream.
+      offset (float): Time in seconds to skip from the beginning of the video.
     """
     try:
-        logging.debug("Extracting raw H.264 stream from %s to %s", input_path, output_path)
-        subprocess.run([
-            'ffmpeg', '-y', '-i', input_path,
+        logging.debug("Extracting raw H.264 stream from %s to %s (offset %s)", input_path, output_path, offset)
+        seek_args = ['-ss', str(offset)] if offset > 0 else []
+        subprocess.run(['ffmpeg', '-y'] + seek_args + [
+            '-i', input_path,
             '-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb', output_path
-        ], check=True)
+        ], check=True, stdin=subprocess.DEVNULL)
         logging.info("Extraction completed for %s", input_path)
     except subprocess.CalledProcessError as e:
         logging.error("Failed to extract raw stream from %s: %s", input_path, e)
         raise
 
-def corrupt_nal(nal, corruption_intensity):
+def find_start_codes(data):
+    """
+    Locate every 4-byte Annex B start code (00 00 00 01) in a raw H.264 buffer.
+
+    The search uses the buffer's own find method, which is backed by memchr and
+    touches each byte once without allocating, so it stays fast and flat in memory
+    even on multi-GB mapped streams.
+
+    Parameters:
+      data (bytes or mmap.mmap): The raw Annex B stream.
+
+    Returns:
+      numpy.ndarray: Ascending int64 offsets of each start code.
     """
-    Introduce artificial corruption to a NAL unit by modifying one random byte in its payload.
+    start_code = b'\x00\x00\x00\x01'
+    offsets = []
+    start = 0
+    while True:
+        idx = data.find(start_code, start)
+        if idx == -1:
+            break
+        offsets.append(idx)
+        start = idx + 4
+    return np.array(offsets, dtype=np.int64)
+
+def map_file(f):
+    """
+    Memory-map an open file read-only so it can be sliced without copying.
+
+    The mapping stays valid after the file is closed and is released once the
+    last view into it goes away.
+
+    Parameters:
+      f (file): A file object opened in binary read mode.
+
+    Returns:
+      mmap.mmap or bytes: The mapped contents (empty bytes for an empty file).
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def write_buffers(f, buffers):
+    """
+    Write a sequence of bytes-like objects to a file with scatter-gather I/O.
+
+    On platforms with os.writev the buffers are handed to the kernel in batches
+    of up to IOV_MAX, otherwise they are written one at a time.
+
+    Parameters:
+      f (file): A file object opened in binary write mode.
+      buffers (list): The bytes-like objects to write, in order.
+    """
+    if not hasattr(os, 'writev'):
+        for buf in buffers:
+            f.write(buf)
+        return
+
+    f.flush()
+    fd = f.fileno()
+    for i in range(0, len(buffers), _IOV_MAX):
+        batch = buffers[i:i + _IOV_MAX]
+        written = os.writev(fd, batch)
+        # Finish off any buffers the kernel only partially accepted.
+        for buf in batch:
+            if written >= len(buf):
+                written -= len(buf)
+                continue
+            rest = memoryview(buf)[written:]
+            while rest:
+                rest = rest[os.write(fd, rest):]
+            written = 0
+
+def corrupt_nal(nal, corruption_intensity, rng):
+    """
+    Introduce artificial corruption to a NAL unit in place by XORing random bytes in its payload.
+    Roughly one byte in every 2550 / corruption_intensity is hit (at least one), and each
+    hit byte is XORed with a random value scaled by the intensity.
     
     Parameters:
-      nal (bytes): The original NAL unit.
+      nal (bytearray or memoryview): A writable copy of the NAL unit, modified in place.
       corruption_intensity (int): A value from 0 to 100 indicating the intensity of corruption.
-      
-    Returns:
-      bytes: The corrupted NAL unit.
+      rng (numpy.random.Generator): Source of the corrupted positions and values.
     """
-    ba = bytearray(nal)
-    if len(ba) > 5:
-        # Choose a random index beyond the header to corrupt.
-        index_to_corrupt = random.randint(5, len(ba) - 1)
-        # Determine the maximum change based on the corruption intensity.
+    # Out-of-range intensities from the form are clamped to 0-100.
+    corruption_intensity = min(100, max(0, corruption_intensity))
+    payload = np.frombuffer(nal, dtype=np.uint8)
+    if len(payload) > 5:
+        # Determine how many bytes to hit and the maximum change based on the intensity.
+        count = max(1, int(corruption_intensity * len(payload) / 2550))
         max_change = max(1, int(255 * corruption_intensity / 100))
-        change = random.randint(1, max_change)
-        ba[index_to_corrupt] = (ba[index_to_corrupt] + change) % 256
-    return bytes(ba)
+        # Choose random indices beyond the header to corrupt.
+        indices = rng.integers(5, len(payload), size=count)
+        payload[indices] ^= rng.integers(1, max_change + 1, size=count, dtype=np.uint8)
+
+def classify_nal_chunk(buf, starts, ends, remove_spspps='yes', removal_mode='first'):
+    """
+    Read the types of a run of NAL units and apply the removal options that depend
+    only on each unit itself (everything except removing the first I-frame).
+
+    Parameters:
+      buf (numpy.ndarray): The raw Annex B stream as uint8.
+      starts (numpy.ndarray): Offset of each NAL unit's start code.
+      ends (numpy.ndarray): Offset just past the end of each NAL unit.
+      remove_spspps (str): 'yes' to remove SPS/PPS (NAL types 7 & 8).
+      removal_mode (str): I-frame removal mode: 'none', 'first', or 'all'.
+
+    Returns:
+      tuple: (types, keep) arrays holding each NAL unit's type and whether it is kept.
+    """
+    # NAL units too short to carry a header byte are skipped entirely.
+    keep = ends - starts >= 5
+    types = np.zeros(len(starts), dtype=np.uint8)
+    types[keep] = buf[starts[keep] + 4] & 0x1F
+
+    # Remove SPS (7) and PPS (8) if requested.
+    if remove_spspps == 'yes':
+        keep &= (types != 7) & (types != 8)
+
+    # Remove all I-frames if requested.
+    if removal_mode == 'all':
+        keep &= types != 5
+
+    return types, keep
+
+def classify_nals(data, starts, ends, remove_spspps='yes', removal_mode='first'):
+    """
+    Read the type of every NAL unit and decide which ones the removal options keep.
+    Very long streams are split into chunks classified on parallel threads; NumPy
+    releases the GIL while it works, so the chunks run concurrently.
+
+    Parameters:
+      data (bytes-like): The raw Annex B stream.
+      starts (numpy.ndarray): Offset of each NAL unit's start code.
+      ends (numpy.ndarray): Offset just past the end of each NAL unit.
+      remove_spspps (str): 'yes' to remove SPS/PPS (NAL types 7 & 8).
+      removal_mode (str): I-frame removal mode: 'none', 'first', or 'all'.
+
+    Returns:
+      tuple: (types, keep) arrays holding each NAL unit's type and whether it is kept.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    num_chunks = min(os.cpu_count() or 1, -(-len(starts) // _CLASSIFY_CHUNK_SIZE))
+    if num_chunks > 1:
+        bounds = np.linspace(0, len(starts), num_chunks + 1).astype(np.int64).tolist()
+        with ThreadPoolExecutor(max_workers=num_chunks) as pool:
+            chunks = list(pool.map(
+                lambda lo, hi: classify_nal_chunk(buf, starts[lo:hi], ends[lo:hi], remove_spspps, removal_mode),
+                bounds[:-1], bounds[1:]))
+        types = np.concatenate([chunk_types for chunk_types, _ in chunks])
+        keep = np.concatenate([chunk_keep for _, chunk_keep in chunks])
+    else:
+        types, keep = classify_nal_chunk(buf, starts, ends, remove_spspps, removal_mode)
+
+    # Removing the first I-frame needs the whole stream, so it is done after the chunks.
+    if removal_mode == 'first':
+        idr = np.flatnonzero(keep & (types == 5))
+        if len(idr):
+            keep[idr[0]] = False
+
+    return types, keep
+
+def build_output_plan(starts, ends, types, keep, rolls, rng, duplicate_pframes=1,
+                      duplicate_probability=100, corrupt_pframes_chance=0):
+    """
+    Lay out the output stream as PLAN_DTYPE rows without looping in Python.
+    Every kept P-frame (NAL type 1) whose duplicate roll passes is repeated
+    duplicate_pframes times, and each of those copies is flagged for corruption
+    when its own corrupt roll passes. Corrupt rolls are only drawn for the copies
+    themselves, so their memory grows with the output rather than the input. Consecutive uncorrupted copies share a single
+    row whose count says how many times it is written.
+
+    Parameters:
+      starts (numpy.ndarray): Offset of each NAL unit's start code.
+      ends (numpy.ndarray): Offset just past the end of each NAL unit.
+      types (numpy.ndarray): NAL unit type of each NAL unit.
+      keep (numpy.ndarray): Whether each NAL unit survives removal and dropping.
+      rolls (numpy.ndarray): Per-NAL rolls (0-100); column 1 decides duplication.
+      rng (numpy.random.Generator): Source of the corrupt rolls of each duplicate.
+      duplicate_pframes (int): Number of times to duplicate each P-frame.
+      duplicate_probability (int): Percentage chance (0-100) to duplicate a P-frame.
+      corrupt_pframes_chance (int): Percentage chance (0-100) to corrupt a P-frame.
+
+    Returns:
+      numpy.ndarray: A PLAN_DTYPE array of (start, end, count, corrupt) rows in output order.
+    """
+    kept = np.flatnonzero(keep)
+    duplicated = (types[kept] == 1) & (rolls[kept, 1] < duplicate_probability)
+    counts = np.where(duplicated, max(duplicate_pframes, 0), 1)
+    rows = np.repeat(kept, counts)
+
+    corrupt = np.zeros(len(rows), dtype=bool)
+    if corrupt_pframes_chance > 0:
+        # Each duplicated copy gets its own corrupt roll.
+        copies = np.flatnonzero(np.repeat(duplicated, counts))
+        corrupt[copies] = rng.random(len(copies), dtype=np.float32) * 100 < corrupt_pframes_chance
+
+    # Start a new row for every NAL unit and around every corrupted copy, so only
+    # runs of identical uncorrupted copies are merged.
+    new_row = np.ones(len(rows), dtype=bool)
+    new_row[1:] = (rows[1:] != rows[:-1]) | corrupt[1:] | corrupt[:-1]
+    first = np.flatnonzero(new_row)
+
+    plan = np.empty(len(first), dtype=PLAN_DTYPE)
+    plan['start'] = starts[rows[first]]
+    plan['end'] = ends[rows[first]]
+    plan['count'] = np.diff(np.append(first, len(rows)))
+    plan['corrupt'] = corrupt[first]
+    return plan
+
+def window_permutation(length, window_size, reorder_intensity, rng):
+    """
+    Build a permutation that shuffles consecutive windows of a sequence, each with a
+    probability of reorder_intensity percent, in a single sort rather than a loop.
+
+    Parameters:
+      length (int): Length of the sequence being reordered.
+      window_size (int): Number of entries in each window.
+      reorder_intensity (int): Percentage chance (0-100) that a window is shuffled.
+      rng (numpy.random.Generator): Source of the window rolls and shuffle keys.
+
+    Returns:
+      numpy.ndarray: Indices that reorder the sequence.
+    """
+    window_ids = np.arange(length) // window_size
+    num_windows = -(-length // window_size)
+    shuffled = rng.random(num_windows, dtype=np.float32) * 100 < reorder_intensity
+    logging.debug("Shuffling %d of %d windows", np.count_nonzero(shuffled), num_windows)
+
+    # Entries in shuffled windows sort by a random key; the rest keep their position.
+    keys = np.where(shuffled[window_ids], rng.random(length), np.arange(length) / max(length, 1))
+    return np.lexsort((keys, window_ids))
 
 def process_video2_raw(input_path, output_path, remove_spspps='yes', removal_mode='first',
                        duplicate_pframes=1, duplicate_probability=100,
@@ -67,167 +306,159 @@ def process_video2_raw(input_path, output_path, remove_spspps='yes', removal_mod
       drop_frame_percentage (int): Percentage chance (0-100) to drop any frame.
     """
     try:
+        # With every effect disabled the stream passes through unchanged, so link it
+        # (or copy it where hard links are unsupported) instead of rewriting it.
+        effects_active = (remove_spspps == 'yes' or removal_mode in ('first', 'all')
+                          or (duplicate_probability > 0
+                              and (duplicate_pframes != 1 or corrupt_pframes_chance > 0))
+                          or drop_frame_percentage > 0
+                          or (reorder_intensity > 0 and reorder_window_size > 1))
+        if not effects_active:
+            logging.debug("No datamoshing effects requested; passing %s through unchanged", input_path)
+            if os.path.exists(output_path) and os.path.samefile(input_path, output_path):
+                return
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            try:
+                os.link(input_path, output_path)
+            except OSError:
+                shutil.copyfile(input_path, output_path)
+            logging.info("Video2 raw stream passed through unchanged to %s", output_path)
+            return
+
         logging.debug("Processing raw video stream %s with advanced datamoshing options", input_path)
-        # Read the entire raw video file.
+        # Map the raw video file rather than reading it into memory.
         with open(input_path, "rb") as f:
-            data = f.read()
-
-        # Define the start code used in H.264 streams.
-        start_code = b'\x00\x00\x00\x01'
-        nals = []
-        offsets = []
-        start = 0
-
-        # Identify the start of each NAL unit.
-        while True:
-            idx = data.find(start_code, start)
-            if idx == -1:
-                break
-            offsets.append(idx)
-            start = idx + 4
-        offsets.append(len(data))
-        for i in range(len(offsets) - 1):
-            nal = data[offsets[i]:offsets[i+1]]
-            nals.append(nal)
-
-        processed_nals = []
-        removed_first_idr = False
-
-        # Iterate through each NAL unit applying the chosen datamoshing effects.
-        for nal in nals:
-            if len(nal) < 5:
-                continue  # Skip invalid NAL units.
-            nal_type = nal[4] & 0x1F
-
-            # Remove SPS (7) and PPS (8) if requested.
-            if remove_spspps == 'yes' and nal_type in [7, 8]:
-                continue
+            data = map_file(f)
 
-            # I-frame removal logic based on removal_mode.
-            if removal_mode == 'first' and not removed_first_idr and nal_type == 5:
-                removed_first_idr = True
-                continue
-            elif removal_mode == 'all' and nal_type == 5:
-                continue
+        # Identify the start and end of each NAL unit.
+        starts = find_start_codes(data)
+        ends = np.empty_like(starts)
+        ends[:-1] = starts[1:]
+        ends[-1:] = len(data)
 
-            # Randomly drop frames based on drop_frame_percentage.
-            if drop_frame_percentage > 0:
-                if random.uniform(0, 100) < drop_frame_percentage:
-                    continue
-
-            # Process P-frames (NAL type 1) with duplication and potential corruption.
-            if nal_type == 1:
-                if random.uniform(0, 100) < duplicate_probability:
-                    # Duplicate the P-frame the specified number of times.
-                    for _ in range(duplicate_pframes):
-                        temp_nal = nal
-                        if corrupt_pframes_chance > 0 and random.uniform(0, 100) < corrupt_pframes_chance:
-                            temp_nal = corrupt_nal(nal, corruption_intensity)
-                        processed_nals.append(temp_nal)
-                else:
-                    processed_nals.append(nal)
-                continue  # Skip normal append since P-frame handled.
-
-            # For all other frames, append as is.
-            processed_nals.append(nal)
+        # Decide which NAL units survive the removal options in one vectorized pass.
+        types, keep = classify_nals(data, starts, ends, remove_spspps, removal_mode)
+
+        # Roll the per-NAL decisions up front: column 0 drops a frame and column 1
+        # duplicates a P-frame.
+        rng = np.random.default_rng()
+        rolls = rng.random((len(keep), 2), dtype=np.float32) * 100
+
+        # Randomly drop frames based on drop_frame_percentage.
+        if drop_frame_percentage > 0:
+            keep &= rolls[:, 0] >= drop_frame_percentage
+
+        # Lay out every output NAL unit before touching any payload.
+        plan = build_output_plan(starts, ends, types, keep, rolls, rng, duplicate_pframes,
+                                 duplicate_probability, corrupt_pframes_chance)
+
+        # The output order holds one plan row index for every NAL unit written.
+        order = np.repeat(np.arange(len(plan)), plan['count'])
 
         # Apply localized reordering if requested.
         if reorder_intensity > 0 and reorder_window_size > 1:
-            new_nals = []
-            for i in range(0, len(processed_nals), reorder_window_size):
-                window = processed_nals[i:i + reorder_window_size]
-                # With a probability based on reorder_intensity, shuffle this window.
-                if random.uniform(0, 100) < reorder_intensity:
-                    random.shuffle(window)
-                    logging.debug("Shuffled a window of %d frames", len(window))
-                new_nals.extend(window)
-            processed_nals = new_nals
+            order = order[window_permutation(len(order), reorder_window_size, reorder_intensity, rng)]
+        entries = plan[order]
+
+        # Slice each plan row once; repeated copies reuse the same view.
+        view = memoryview(data)
+        row_views = [view[start:end] for start, end in zip(plan['start'].tolist(), plan['end'].tolist())]
+        processed_nals = [row_views[row] for row in order.tolist()]
 
         # Write the processed NAL units to the output file.
+        lengths = entries['end'] - entries['start']
+        corrupted = np.flatnonzero(entries['corrupt'])
+        # The output may be a link to the input left by an earlier pass-through;
+        # truncating it in place would pull the mapped pages out from under us.
+        if os.path.lexists(output_path):
+            os.remove(output_path)
         with open(output_path, "wb") as f:
-            for nal in processed_nals:
-                f.write(nal)
+            if lengths.sum() <= _SINGLE_WRITE_LIMIT:
+                # join sizes the output buffer once and copies every NAL unit in C;
+                # corrupted copies are then mutated in place inside that buffer.
+                out = bytearray().join(processed_nals)
+                out_view = memoryview(out)
+                positions = np.cumsum(lengths) - lengths
+                for pos, length in zip(positions[corrupted].tolist(), lengths[corrupted].tolist()):
+                    corrupt_nal(out_view[pos:pos + length], corruption_intensity, rng)
+                out_view.release()
+                f.write(out)
+            else:
+                # The mapped input is read-only, so only the corrupted copies are duplicated.
+                for i in corrupted.tolist():
+                    processed_nals[i] = bytearray(processed_nals[i])
+                    corrupt_nal(processed_nals[i], corruption_intensity, rng)
+                write_buffers(f, processed_nals)
         logging.info("Advanced processing of video2 raw stream completed. Output saved to %s", output_path)
     except Exception as e:
         logging.error("Error processing video2 raw stream: %s", e, exc_info=True)
         raise
 
-def apply_offset(input_path, output_path, offset):
-    """
-    Apply a time offset to a video file using ffmpeg to skip a specified duration.
-    
-    Parameters:
-      input_path (str): Path to the input file.
-      output_path (str): Destination file path after applying the offset.
-      offset (float): Time in seconds to skip from the beginning of the video.
-    """
-    try:
-        logging.debug("Applying offset of %s seconds to %s", offset, input_path)
-        subprocess.run([
-            'ffmpeg', '-y', '-ss', str(offset), '-i', input_path,
-            '-c', 'copy', output_path
-        ], check=True)
-        logging.info("Offset applied successfully. Output saved to %s", output_path)
-    except subprocess.CalledProcessError as e:
-        logging.error("Failed to apply offset to %s: %s", input_path, e)
-        raise
-
-def concatenate_streams(video1_raw, video2_processed, output_path):
+def remux_to_mp4(input_paths, output_path, reencode=False):
     """
-    Concatenate two raw H.264 streams into one file.
+    Join raw H.264 streams and remux them into an MP4 container using ffmpeg.
+    The streams are fed one after another into ffmpeg's stdin and read with the raw H.264
+    demuxer, so no combined intermediate file is written. By default the datamoshed
+    bitstream is stream-copied into the container untouched; with reencode the video is
+    re-encoded using libx264 with settings that preserve quality while generating a smooth
+    output. It also includes the '-movflags faststart' flag to ensure that the moov atom is
+    placed at the beginning of the file for better streaming. Additionally,
+    '-err_detect ignore_err' is used to skip over non-critical errors.
     
     Parameters:
-      video1_raw (str): Path to the first raw video stream.
-      video2_processed (str): Path to the processed second video stream.
-      output_path (str): Destination file path for the concatenated output.
-    """
-    try:
-        logging.debug("Concatenating streams: %s and %s into %s", video1_raw, video2_processed, output_path)
-        with open(output_path, "wb") as outfile:
-            with open(video1_raw, "rb") as infile:
-                outfile.write(infile.read())
-            with open(video2_processed, "rb") as infile:
-                outfile.write(infile.read())
-        logging.info("Concatenation completed. Combined file saved to %s", output_path)
-    except Exception as e:
-        logging.error("Error during concatenation: %s", e, exc_info=True)
-        raise
-
-def remux_to_mp4(input_path, output_path):
-    """
-    Remux and re-encode a concatenated raw H.264 stream into an MP4 container using ffmpeg.
-    This version re-encodes the video using libx264 with settings that preserve quality 
-    while generating a smooth output. It also includes the '-movflags faststart' flag to
-    ensure that the moov atom is placed at the beginning of the file for better streaming.
-    Additionally, '-err_detect ignore_err' is used to skip over non-critical errors.
-    
-    Parameters:
-      input_path (str): Path to the concatenated raw video file.
+      input_paths (list): Paths to the raw video files, in playback order.
       output_path (str): Destination file path for the MP4 output.
+      reencode (bool): Re-encode with libx264 instead of copying the H.264 stream.
     """
     try:
-        logging.debug("Re-encoding raw stream %s to MP4 format at %s with faststart", input_path, output_path)
-        subprocess.run([
-            'ffmpeg', '-y', '-fflags', '+genpts', '-err_detect', 'ignore_err', '-i', input_path,
-            '-c:v', 'libx264', '-crf', '18', '-preset', 'fast', 
+        if reencode:
+            codec_args = ['-c:v', 'libx264', '-crf', '18', '-preset', 'fast']
+        else:
+            codec_args = ['-c:v', 'copy']
+        args = [
+            'ffmpeg', '-y', '-fflags', '+genpts', '-err_detect', 'ignore_err',
+            '-f', 'h264', '-i', 'pipe:0'
+        ] + codec_args + [
             '-movflags', 'faststart', output_path
-        ], check=True)
-        logging.info("Re-encoding and remuxing completed. Output MP4 saved to %s", output_path)
+        ]
+        logging.debug("Remuxing raw streams %s to MP4 format at %s with faststart (re-encode: %s)",
+                      input_paths, output_path, reencode)
+        process = subprocess.Popen(args, stdin=subprocess.PIPE)
+        try:
+            for path in input_paths:
+                with open(path, "rb") as infile:
+                    shutil.copyfileobj(infile, process.stdin, 1 << 20)
+        except BrokenPipeError:
+            # ffmpeg stopped reading early; its exit status below reports the failure.
+            pass
+        except Exception:
+            process.kill()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args)
+        logging.info("Remuxing completed. Output MP4 saved to %s", output_path)
     except subprocess.CalledProcessError as e:
-        logging.error("Failed to re-encode to MP4: %s", e)
+        logging.error("Failed to remux to MP4: %s", e)
         raise
 
 def process_videos(video1_path, video2_path, uid, remove_spspps, removal_mode,
                    offset, upload_folder, duplicate_pframes=1, duplicate_probability=100,
                    reorder_intensity=0, reorder_window_size=10,
-                   corrupt_pframes_chance=0, corruption_intensity=50, drop_frame_percentage=0):
+                   corrupt_pframes_chance=0, corruption_intensity=50, drop_frame_percentage=0,
+                   reencode=False):
     """
     Execute the complete video processing pipeline:
-      1. Extract raw H.264 streams from both input videos.
+      1. Extract raw H.264 streams from both input videos in parallel, skipping the
+         offset at the start of the second video.
       2. Process the second video's raw stream with advanced datamoshing options.
-      3. Apply an offset to the processed second video if required.
-      4. Concatenate the raw streams.
-      5. Remux the concatenated stream into an MP4 container.
+      3. Join the raw streams and remux them into an MP4 container.
     
     Parameters:
       video1_path (str): Path to the first video file.
@@ -244,6 +475,7 @@ def process_videos(video1_path, video2_path, uid, remove_spspps, removal_mode,
       corrupt_pframes_chance (int): Chance (0-100) to corrupt a P-frame.
       corruption_intensity (int): Intensity (0-100) of the corruption applied.
       drop_frame_percentage (int): Chance (0-100) to drop a frame.
+      reencode (bool): Re-encode the final video with libx264 instead of stream-copying it.
       
     Returns:
       str: Path to the final processed MP4 video.
@@ -253,30 +485,21 @@ def process_videos(video1_path, video2_path, uid, remove_spspps, removal_mode,
         video1_raw = os.path.join(upload_folder, f"video1_{uid}.264")
         video2_raw = os.path.join(upload_folder, f"video2_{uid}.264")
         video2_processed = os.path.join(upload_folder, f"video2_processed_{uid}.264")
-        video2_final = os.path.join(upload_folder, f"video2_final_{uid}.264")
-        concatenated_raw = os.path.join(upload_folder, f"final_{uid}.264")
         final_output = os.path.join(upload_folder, f"output_{uid}.mp4")
 
-        # Step 1: Extract raw H.264 streams from both videos.
-        extract_raw_stream(video1_path, video1_raw)
-        extract_raw_stream(video2_path, video2_raw)
+        # Step 1: Extract raw H.264 streams from both videos. Each extraction is its own
+        # ffmpeg process, so running them side by side is not held back by the GIL.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(extract_raw_stream, [video1_path, video2_path], [video1_raw, video2_raw],
+                          [0, offset]))
 
         # Step 2: Process the raw stream of the second video with advanced effects.
         process_video2_raw(video2_raw, video2_processed, remove_spspps, removal_mode,
                            duplicate_pframes, duplicate_probability, reorder_intensity, reorder_window_size,
                            corrupt_pframes_chance, corruption_intensity, drop_frame_percentage)
 
-        # Step 3: Apply offset if specified.
-        if offset > 0:
-            apply_offset(video2_processed, video2_final, offset)
-        else:
-            video2_final = video2_processed
-
-        # Step 4: Concatenate the two raw video streams.
-        concatenate_streams(video1_raw, video2_final, concatenated_raw)
-
-        # Step 5: Remux the concatenated raw stream into an MP4 container.
-        remux_to_mp4(concatenated_raw, final_output)
+        # Step 3: Join the two raw streams and remux them into an MP4 container.
+        remux_to_mp4([video1_raw, video2_processed], final_output, reencode)
 
         logging.info("Video processing pipeline completed successfully.")
         return final_output